@@ -13,82 +13,141 @@ Usage:
     python scripts/collect_plate_formats.py              # Full run
     python scripts/collect_plate_formats.py --country DE  # Single country
     python scripts/collect_plate_formats.py --dry-run     # Fetch wikitext only, no LLM calls
+    python scripts/collect_plate_formats.py --batch       # One OpenAI Batch API job (50% cheaper)
+    python scripts/collect_plate_formats.py --refresh DE  # Re-extract DE, bypassing the LLM cache
+    python scripts/collect_plate_formats.py --no-wiki-cache  # Re-download all wikitext
+
+Raw model replies are cached in dataset/metadata/.llm_cache/, keyed by model,
+prompt version and article content, so re-runs only pay for what changed.
+Fetched wikitext is cached for 24 hours in dataset/metadata/.wiki_cache/, so
+repeated runs (e.g. --dry-run while iterating on the prompt) need no network.
 """
 
 import argparse
+import asyncio
+import collections
+import functools
+import hashlib
 import json
 import os
+import re
 import time
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Optional
 
+import httpx
 import openai
-import requests
+import tiktoken
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # ---------------------------------------------------------------------------
 # Constants
 # ---------------------------------------------------------------------------
 WIKIPEDIA_API_URL = "https://en.wikipedia.org/w/api.php"
 USER_AGENT = "PlateSpotter/1.0 (https://github.com/platespotter; contact@platespotter.dev)"
-REQUEST_DELAY = 1.0
-
-# Countries clickable on the SVG map (ISO code -> country name, Wikipedia article suffix)
-COUNTRIES = {
-    "AL": ("Albania", "Albania"),
-    "AD": ("Andorra", "Andorra"),
-    "AM": ("Armenia", "Armenia"),
-    "AT": ("Austria", "Austria"),
-    "BY": ("Belarus", "Belarus"),
-    "BE": ("Belgium", "Belgium"),
-    "BA": ("Bosnia and Herzegovina", "Bosnia_and_Herzegovina"),
-    "BG": ("Bulgaria", "Bulgaria"),
-    "CH": ("Switzerland", "Switzerland"),
-    "CY": ("Cyprus", "Cyprus"),
-    "CZ": ("Czech Republic", "the_Czech_Republic"),
-    "DE": ("Germany", "Germany"),
-    "DK": ("Denmark", "Denmark"),
-    "EE": ("Estonia", "Estonia"),
-    "ES": ("Spain", "Spain"),
-    "FI": ("Finland", "Finland"),
-    "FR": ("France", "France"),
-    "GB": ("United Kingdom", "the_United_Kingdom"),
-    "GE": ("Georgia", "Georgia_(country)"),
-    "GR": ("Greece", "Greece"),
-    "HR": ("Croatia", "Croatia"),
-    "HU": ("Hungary", "Hungary"),
-    "IE": ("Ireland", "the_Republic_of_Ireland"),
-    "IS": ("Iceland", "Iceland"),
-    "IT": ("Italy", "Italy"),
-    "LI": ("Liechtenstein", "Liechtenstein"),
-    "LT": ("Lithuania", "Lithuania"),
-    "LU": ("Luxembourg", "Luxembourg"),
-    "LV": ("Latvia", "Latvia"),
-    "MD": ("Moldova", "Moldova"),
-    "ME": ("Montenegro", "Montenegro"),
-    "MK": ("North Macedonia", "North_Macedonia"),
-    "NL": ("Netherlands", "the_Netherlands"),
-    "NO": ("Norway", "Norway"),
-    "PL": ("Poland", "Poland"),
-    "PT": ("Portugal", "Portugal"),
-    "RO": ("Romania", "Romania"),
-    "RS": ("Serbia", "Serbia"),
-    "SE": ("Sweden", "Sweden"),
-    "SI": ("Slovenia", "Slovenia"),
-    "SK": ("Slovakia", "Slovakia"),
-    "TR": ("Turkey", "Turkey"),
-    "UA": ("Ukraine", "Ukraine"),
-    "XK": ("Kosovo", "Kosovo"),
-}
+# Client-side budget for Wikipedia API calls; bursts within it never sleep
+WIKI_MAX_REQUESTS = 5
+WIKI_RATE_PERIOD = 5.0
+# Ask MediaWiki to reject requests while its replicas lag by more than this
+# many seconds (https://www.mediawiki.org/wiki/Manual:Maxlag_parameter)
+MAXLAG = 5
+MAX_RETRIES = 5
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+RETRY_BACKOFF = 0.5  # seconds; doubled on every attempt unless Retry-After says otherwise
+MAX_TITLES_PER_QUERY = 50
+# Default number of OpenAI requests in flight; well inside tier-1 RPM limits
+EXTRACT_CONCURRENCY = 8
+EXTRACTION_MODEL = "gpt-4o-mini"
+# Bump whenever SYSTEM_PROMPT, USER_PROMPT_PREFIX, trim_wikitext,
+# truncate_wikitext or the request parameters change so cached replies are not reused
+PROMPT_VERSION = 8
+LLM_CACHE_DIR = ".llm_cache"
+WIKI_CACHE_DIR = ".wiki_cache"
+WIKI_CACHE_TTL = 24 * 60 * 60  # seconds
+
+SECTION_HEADING_RE = re.compile(r"^(={2,6})\s*(.+?)\s*\1\s*$", re.MULTILINE)
+# Section headings worth sending to the LLM, roughly one alternative per output field
+RELEVANT_SECTION_RE = re.compile(
+    r"current|format|colou?r|dimension|size|typeface|font|design|letter|alphabet"
+    r"|vanity|personali[sz]ed|banned|forbidden|prohibited",
+    re.IGNORECASE,
+)
+# Articles are cut to this many tokens of the model's tokenizer
+MAX_WIKITEXT_TOKENS = 20000
+BATCH_POLL_INTERVAL = 30
+
+# Countries clickable on the SVG map: (ISO code, country name, Wikipedia article suffix)
+COUNTRIES: tuple[tuple[str, str, str], ...] = (
+    ("AL", "Albania", "Albania"),
+    ("AD", "Andorra", "Andorra"),
+    ("AM", "Armenia", "Armenia"),
+    ("AT", "Austria", "Austria"),
+    ("BY", "Belarus", "Belarus"),
+    ("BE", "Belgium", "Belgium"),
+    ("BA", "Bosnia and Herzegovina", "Bosnia_and_Herzegovina"),
+    ("BG", "Bulgaria", "Bulgaria"),
+    ("CH", "Switzerland", "Switzerland"),
+    ("CY", "Cyprus", "Cyprus"),
+    ("CZ", "Czech Republic", "the_Czech_Republic"),
+    ("DE", "Germany", "Germany"),
+    ("DK", "Denmark", "Denmark"),
+    ("EE", "Estonia", "Estonia"),
+    ("ES", "Spain", "Spain"),
+    ("FI", "Finland", "Finland"),
+    ("FR", "France", "France"),
+    ("GB", "United Kingdom", "the_United_Kingdom"),
+    ("GE", "Georgia", "Georgia_(country)"),
+    ("GR", "Greece", "Greece"),
+    ("HR", "Croatia", "Croatia"),
+    ("HU", "Hungary", "Hungary"),
+    ("IE", "Ireland", "the_Republic_of_Ireland"),
+    ("IS", "Iceland", "Iceland"),
+    ("IT", "Italy", "Italy"),
+    ("LI", "Liechtenstein", "Liechtenstein"),
+    ("LT", "Lithuania", "Lithuania"),
+    ("LU", "Luxembourg", "Luxembourg"),
+    ("LV", "Latvia", "Latvia"),
+    ("MD", "Moldova", "Moldova"),
+    ("ME", "Montenegro", "Montenegro"),
+    ("MK", "North Macedonia", "North_Macedonia"),
+    ("NL", "Netherlands", "the_Netherlands"),
+    ("NO", "Norway", "Norway"),
+    ("PL", "Poland", "Poland"),
+    ("PT", "Portugal", "Portugal"),
+    ("RO", "Romania", "Romania"),
+    ("RS", "Serbia", "Serbia"),
+    ("SE", "Sweden", "Sweden"),
+    ("SI", "Slovenia", "Slovenia"),
+    ("SK", "Slovakia", "Slovakia"),
+    ("TR", "Turkey", "Turkey"),
+    ("UA", "Ukraine", "Ukraine"),
+    ("XK", "Kosovo", "Kosovo"),
+)
+_BY_ISO = {country[0]: country for country in COUNTRIES}
 
-EXTRACTION_PROMPT = """\
-You are given the raw wikitext of a Wikipedia article about vehicle registration plates of {country_name}.
+# The system prompt is identical for every country and deliberately longer than
+# 1024 tokens: OpenAI caches repeated prompt prefixes past that size, so all
+# but the first request of a run are billed at the cached-input rate.  Keep
+# anything country-specific in the user message.
+SYSTEM_PROMPT = """\
+You are a data extraction assistant. Each user message contains the name of a country and the raw wikitext of the English Wikipedia article "Vehicle registration plates of <country>". Your job is to extract structured facts about the CURRENT STANDARD private vehicle registration plate of that country.
 
-Extract the following information about the CURRENT STANDARD private vehicle registration plate. If a piece of information is not available in the article, use null for that field.
+General rules:
+- Only describe the current standard plate issued to ordinary private passenger cars. Ignore historical series, diplomatic, military, police, trade, temporary, export, taxi, motorcycle, trailer, agricultural and other special plates, unless the article states that the standard format is shared with them.
+- If the country issues more than one current format (for example during a transition period), describe the one issued to newly registered cars today.
+- Base every answer on the article text. Do not rely on outside knowledge and do not guess. If a piece of information is not available in the article, use null for that field.
+- Wikitext contains markup: templates ({{...}}), links ([[target|label]]), tables ({| ... |}), references (<ref>...</ref>) and HTML comments. Read through the markup and report the human-readable content only. Never copy markup, citation numbers or reference text into your answers.
+- Infoboxes often hold the most reliable values for dimensions, colours, introduction year and the serial format. Prefer them when they agree with the body text; if they conflict, prefer the more specific and more recent statement.
+- Keep every string concise: one or two sentences at most, in plain English. Use digits for numbers.
 
-Return ONLY a JSON object (no markdown, no explanation) with these fields:
+Return ONLY a JSON object (no markdown, no explanation) with exactly these fields:
 
-{{
+{
   "format_pattern": "The character pattern using L for letter and N for number, e.g. 'LL-NNNN-LL' or 'LLL NNNN'. Show separators (hyphens, spaces) as they appear on the plate.",
   "format_explanation": "Brief explanation of what each part represents (e.g. region code, serial number, etc.)",
   "alphabet": "What alphabet/character set is used (e.g. Latin, Cyrillic, Greek) and any notable restrictions on which letters are used",
@@ -101,76 +160,701 @@ Return ONLY a JSON object (no markdown, no explanation) with these fields:
   "colors_strip": "Color/description of the side strip or band (e.g. 'Blue EU band with yellow stars'). null if no strip.",
   "typeface": "Name of the font/typeface used on the plate. null if not mentioned.",
   "strip_contents": "What is displayed on the strip/band (e.g. 'EU flag and country code D'). null if no strip."
-}}
+}
 
-Here is the wikitext:
+Field guidance:
+- format_pattern: Use L for any letter and N for any digit, one symbol per character. Keep hyphens, spaces and other separators exactly where they appear on the physical plate. If a part varies in length (for example a one- to three-letter area code followed by one or two letters and one to four digits), describe the longest common form and explain the variation in format_explanation. If the plate carries a fixed emblem, seal or sticker between characters, represent it as a space.
+- format_explanation: Say what each group encodes: region, district or city code; serial letters; serial number; check characters; year or age identifier. Mention how serials are allocated if the article says so (sequentially, randomly, by region).
+- alphabet: Name the script (Latin, Cyrillic, Greek, ...). If the article lists letters that are excluded (such as I, O or Q to avoid confusion with digits) or letters restricted to a script overlap (such as Cyrillic letters that look like Latin ones), summarise that restriction.
+- forbidden_combinations: Include offensive or political words, abbreviations reserved for authorities, and combinations withheld for any other stated reason. Summarise rather than list every combination.
+- vanity_plates: State whether personalised plates exist, the rules on length or characters, and the price if the article gives one.
+- year_introduced: A four-digit year as a string, for the current system or design of the standard plate. If separate years are given for the system and the current design, use the later one and keep it to the year only.
+- dimensions: Width × height in millimetres for the standard front plate, e.g. '520 × 110 mm'. If several sizes are permitted, give the standard one first.
+- colors_background and colors_lettering: Plain colour names such as 'White', 'Yellow' or 'Black'. If front and rear plates differ, describe both briefly, e.g. 'White (front), yellow (rear)'.
+- colors_strip: Describe the colour and emblem of the vertical band on the left side, if there is one. For EU member states this is normally a blue band with a circle of yellow stars. Some non-EU countries use a national flag or a coloured band instead.
+- typeface: The official name of the font (for example 'FE-Schrift', 'Charles Wright 2001' or 'DIN 1451'). Use null if the article does not name it; do not describe the font's appearance instead of naming it.
+- strip_contents: What appears on the band, typically a flag or emblem plus the international vehicle registration code (for example 'EU flag and country code F'). Include extra elements such as regional logos only if they are part of the band.
+
+Before answering, check that the object contains exactly the twelve fields above, that every value is either a string or null, and that no value contains wikitext markup.
+"""
+
+PLATE_FORMAT_FIELDS = (
+    "format_pattern",
+    "format_explanation",
+    "alphabet",
+    "forbidden_combinations",
+    "vanity_plates",
+    "year_introduced",
+    "dimensions",
+    "colors_background",
+    "colors_lettering",
+    "colors_strip",
+    "typeface",
+    "strip_contents",
+)
+
+# Structured-outputs schema: the API's constrained decoder guarantees a reply
+# with exactly these keys, each a string or null (descriptions live in SYSTEM_PROMPT)
+PLATE_FORMAT_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "required": list(PLATE_FORMAT_FIELDS),
+    "properties": {field: {"type": ["string", "null"]} for field in PLATE_FORMAT_FIELDS},
+}
+
+# Rendered per country; the wikitext follows as a separate content part, so the
+# (potentially huge) article is never copied through str.format
+USER_PROMPT_PREFIX = """\
+Country: {country_name}
+
+Wikitext:
 
-{wikitext}
 """
 
 
+# ---------------------------------------------------------------------------
+# JSON helpers (orjson when installed, stdlib otherwise)
+# ---------------------------------------------------------------------------
+
+def json_loads(data: str | bytes):
+    """Parse JSON text.  Errors are always json.JSONDecodeError subclasses."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj, indent: bool = False) -> bytes:
+    """Serialize to UTF-8 JSON bytes, optionally indented by two spaces."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None,
+                      ensure_ascii=False).encode("utf-8")
+
+
+# ---------------------------------------------------------------------------
+# Rate limiting
+# ---------------------------------------------------------------------------
+
+class RateLimiter:
+    """Sliding-window limiter: at most `max_calls` calls start in any
+    `period` seconds, no matter how many tasks share it.  Calls within
+    that budget return immediately."""
+
+    def __init__(self, max_calls: int, period: float):
+        self.max_calls = max_calls
+        self.period = period
+        self._lock = asyncio.Lock()
+        self._slots = collections.deque()  # start times, ascending
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            while self._slots and self._slots[0] <= now - self.period:
+                self._slots.popleft()
+            slot = now
+            if len(self._slots) >= self.max_calls:
+                slot = max(now, self._slots[-self.max_calls] + self.period)
+            self._slots.append(slot)
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class Backoff:
+    """Shared pause: once any task calls `pause`, every task's `wait`
+    blocks until the pause is over.  Lets one rate-limit reply slow down
+    the whole fan-out instead of just the task that received it."""
+
+    def __init__(self):
+        self._resume_at = 0.0  # time.monotonic() value
+
+    def pause(self, seconds: float) -> None:
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    async def wait(self) -> None:
+        # Loop because another task may extend the pause while we sleep
+        while (delay := self._resume_at - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+
+wiki_limiter = RateLimiter(WIKI_MAX_REQUESTS, WIKI_RATE_PERIOD)
+openai_backoff = Backoff()
+
+
 # ---------------------------------------------------------------------------
 # API helpers
 # ---------------------------------------------------------------------------
 
-def fetch_article_wikitext(session: requests.Session, article_suffix: str) -> Optional[str]:
-    """Fetch wikitext for a 'Vehicle registration plates of X' article."""
-    title = f"Vehicle_registration_plates_of_{article_suffix}"
-    time.sleep(REQUEST_DELAY)
-    params = {
-        "action": "parse",
-        "page": title,
-        "prop": "wikitext",
-        "format": "json",
+def _retry_delay(resp: httpx.Response, attempt: int) -> float:
+    """Seconds to wait before retrying: Retry-After if given, else exponential backoff."""
+    try:
+        return float(resp.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return RETRY_BACKOFF * 2 ** attempt
+
+
+async def _api_get(session: httpx.AsyncClient, params: dict) -> dict:
+    """Rate-limited GET to the Wikipedia API; safe to call from several tasks.
+
+    Connection errors are retried by the client's transport.  HTTP 429/5xx
+    responses and maxlag errors are retried here with backoff, honouring
+    Retry-After; anything else, or running out of attempts, raises.
+    """
+    params["format"] = "json"
+    params["maxlag"] = MAXLAG
+    for attempt in range(MAX_RETRIES):
+        await wiki_limiter.acquire()
+        resp = await session.get(WIKIPEDIA_API_URL, params=params)
+        if resp.status_code in RETRY_STATUSES and attempt < MAX_RETRIES - 1:
+            wait = _retry_delay(resp, attempt)
+            print(f"  HTTP {resp.status_code} from Wikipedia -- retrying in {wait:.1f}s")
+            await asyncio.sleep(wait)
+            continue
+        resp.raise_for_status()
+        data = resp.json()
+        if data.get("error", {}).get("code") == "maxlag":
+            wait = _retry_delay(resp, attempt)
+            print(f"  Wikipedia replicas lagging -- retrying in {wait:.1f}s")
+            await asyncio.sleep(wait)
+            continue
+        return data
+    raise RuntimeError(f"Wikipedia API still lagging after {MAX_RETRIES} attempts")
+
+
+async def _query_latest_revisions(session: httpx.AsyncClient, articles: dict[str, str],
+                                  rvprop: str) -> dict[str, dict]:
+    """Fetch the latest revision of many plates articles in as few requests as possible.
+
+    `articles` maps ISO code -> article suffix.  Titles are sent up to
+    MAX_TITLES_PER_QUERY at a time and `continue` tokens are followed.  Returns
+    ISO code -> revision dict; missing articles are left out.
+    """
+    revisions = {}
+    items = list(articles.items())
+    for i in range(0, len(items), MAX_TITLES_PER_QUERY):
+        chunk = items[i:i + MAX_TITLES_PER_QUERY]
+        params = {
+            "action": "query",
+            "titles": "|".join(f"Vehicle_registration_plates_of_{suffix}"
+                               for _, suffix in chunk),
+            "prop": "revisions",
+            "rvprop": rvprop,
+            "rvslots": "main",
+            "redirects": 1,
+            "formatversion": 2,
+        }
+        pages = {}
+        aliases = {}
+        while True:
+            data = await _api_get(session, dict(params))
+            query = data.get("query", {})
+            # Map requested titles through normalisation ("_" -> " ") and redirects
+            for alias in query.get("normalized", []) + query.get("redirects", []):
+                aliases[alias["from"]] = alias["to"]
+            for page in query.get("pages", []):
+                if page.get("revisions"):
+                    pages[page["title"]] = page["revisions"][0]
+            if "continue" not in data:
+                break
+            params.update(data["continue"])
+
+        for iso, suffix in chunk:
+            title = f"Vehicle_registration_plates_of_{suffix}"
+            seen = set()
+            while title in aliases and title not in seen:
+                seen.add(title)
+                title = aliases[title]
+            if title in pages:
+                revisions[iso] = pages[title]
+    return revisions
+
+
+async def fetch_all_revids(session: httpx.AsyncClient, articles: dict[str, str]) -> dict[str, int]:
+    """Fetch only the latest revision IDs (~1 KB per 50 articles).
+
+    `articles` maps ISO code -> article suffix; returns ISO code -> revid.
+    """
+    revisions = await _query_latest_revisions(session, articles, "ids")
+    return {iso: rev["revid"] for iso, rev in revisions.items()}
+
+
+async def fetch_all_wikitexts(session: httpx.AsyncClient,
+                              articles: dict[str, str]) -> dict[str, tuple[str, int]]:
+    """Fetch wikitext and revision ID of many plates articles at once.
+
+    `articles` maps ISO code -> article suffix; returns ISO code ->
+    (wikitext, revid).  Missing articles are left out.
+    """
+    revisions = await _query_latest_revisions(session, articles, "ids|content")
+    return {
+        iso: (rev["slots"]["main"]["content"], rev["revid"])
+        for iso, rev in revisions.items()
     }
-    resp = session.get(WIKIPEDIA_API_URL, params=params)
-    if resp.status_code == 429:
-        wait = int(resp.headers.get("Retry-After", 60))
-        print(f"  Rate-limited -- waiting {wait}s")
-        time.sleep(wait)
-        resp = session.get(WIKIPEDIA_API_URL, params=params)
-    resp.raise_for_status()
-    data = resp.json()
+
+
+async def fetch_article_wikitext(session: httpx.AsyncClient,
+                                 article_suffix: str) -> tuple[Optional[str], Optional[int]]:
+    """Fetch wikitext and revision ID for a 'Vehicle registration plates of X' article.
+
+    Used for single-country runs.  Returns (None, None) if the article does
+    not exist.
+    """
+    data = await _api_get(session, {
+        "action": "parse",
+        "page": f"Vehicle_registration_plates_of_{article_suffix}",
+        "prop": "wikitext|revid",
+        "redirects": 1,
+    })
     if "error" in data:
+        return None, None
+    parse = data.get("parse", {})
+    return parse.get("wikitext", {}).get("*"), parse.get("revid")
+
+
+# ---------------------------------------------------------------------------
+# Wikitext cache
+# ---------------------------------------------------------------------------
+
+def wiki_cache_get(cache_dir: Optional[Path],
+                   article_suffix: str) -> Optional[tuple[str, int]]:
+    """Return (wikitext, revid) fetched less than WIKI_CACHE_TTL ago, or None."""
+    if cache_dir is None:
         return None
-    return data.get("parse", {}).get("wikitext", {}).get("*")
+    path = cache_dir / f"{article_suffix}.json"
+    if not path.exists() or time.time() - path.stat().st_mtime >= WIKI_CACHE_TTL:
+        return None
+    cached = json_loads(path.read_bytes())
+    return cached["wikitext"], cached["revid"]
 
 
-def extract_with_openai(client: openai.OpenAI, country_name: str, wikitext: str) -> Optional[dict]:
-    """Send wikitext to OpenAI and extract structured plate format data."""
-    # Truncate very long articles to stay within context limits
-    max_chars = 80000
-    if len(wikitext) > max_chars:
-        wikitext = wikitext[:max_chars] + "\n\n[... article truncated ...]"
+def wiki_cache_put(cache_dir: Optional[Path], article_suffix: str,
+                   wikitext: str, revid: int) -> None:
+    """Store freshly fetched wikitext; its mtime starts the TTL."""
+    if cache_dir is None:
+        return
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = cache_dir / f"{article_suffix}.json"
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(json_dumps({"revid": revid, "wikitext": wikitext}))
+    os.replace(tmp_path, path)
+
+
+# ---------------------------------------------------------------------------
+# LLM response cache
+# ---------------------------------------------------------------------------
+
+def llm_cache_key(country_name: str, wikitext: str) -> str:
+    """Content hash identifying one extraction request."""
+    raw = f"{EXTRACTION_MODEL}|{PROMPT_VERSION}|{country_name}|{wikitext}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def llm_cache_get(cache_dir: Optional[Path], key: str) -> Optional[str]:
+    """Return the cached raw reply for `key`, or None on a miss."""
+    if cache_dir is None:
+        return None
+    path = cache_dir / f"{key}.json"
+    if not path.exists():
+        return None
+    return json_loads(path.read_bytes())["response_text"]
+
+
+def llm_cache_put(cache_dir: Optional[Path], key: str, country_name: str,
+                  response_text: str) -> None:
+    """Store a raw reply before it is parsed, so bad JSON is cached too."""
+    if cache_dir is None:
+        return
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = cache_dir / f"{key}.json"
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(json_dumps({
+            "model": EXTRACTION_MODEL,
+            "prompt_version": PROMPT_VERSION,
+            "country_name": country_name,
+            "response_text": response_text,
+            "cached_at": datetime.now(timezone.utc).isoformat(),
+        }, indent=True))
+    os.replace(tmp_path, path)
 
-    prompt = EXTRACTION_PROMPT.format(
-        country_name=country_name,
-        wikitext=wikitext,
-    )
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        max_tokens=1024,
-        messages=[{"role": "user", "content": prompt}],
+# ---------------------------------------------------------------------------
+# Extraction
+# ---------------------------------------------------------------------------
+
+def _extract_template(wikitext: str, start: int) -> str:
+    """Return the {{...}} template starting at `start`, balancing nested braces."""
+    depth = 0
+    i = start
+    while i < len(wikitext) - 1:
+        pair = wikitext[i:i + 2]
+        if pair == "{{":
+            depth += 1
+            i += 2
+        elif pair == "}}":
+            depth -= 1
+            i += 2
+            if depth == 0:
+                return wikitext[start:i]
+        else:
+            i += 1
+    return wikitext[start:]
+
+
+def trim_wikitext(wikitext: str) -> str:
+    """Keep only the parts of an article that the extraction needs.
+
+    That is the lead section, the infobox (wherever it is) and every section
+    whose heading matches RELEVANT_SECTION_RE, together with its subsections.
+    History, galleries, references and the like are dropped.  Articles
+    without any matching section are returned unchanged.
+    """
+    headings = list(SECTION_HEADING_RE.finditer(wikitext))
+    if not headings:
+        return wikitext
+
+    kept = []  # (start, end) of every kept section
+    kept_level = None
+    for i, heading in enumerate(headings):
+        level = len(heading.group(1))
+        if kept_level is not None and level <= kept_level:
+            kept_level = None
+        if kept_level is None and RELEVANT_SECTION_RE.search(heading.group(2)):
+            kept_level = level
+        if kept_level is not None:
+            end = headings[i + 1].start() if i + 1 < len(headings) else len(wikitext)
+            kept.append((heading.start(), end))
+
+    if not kept:
+        return wikitext
+
+    parts = [wikitext[:headings[0].start()]]
+    # An infobox in the lead or in a kept section is already included
+    infobox_start = wikitext.lower().find("{{infobox")
+    if (infobox_start >= headings[0].start()
+            and not any(start <= infobox_start < end for start, end in kept)):
+        parts.append(_extract_template(wikitext, infobox_start) + "\n")
+    parts.extend(wikitext[start:end] for start, end in kept)
+    return "".join(parts)
+
+
+@functools.cache
+def _model_encoding():
+    """The extraction model's tokenizer, loaded once per process.
+
+    Older tiktoken releases don't know the model name; fall back to the
+    o200k_base encoding the GPT-4o family uses.
+    """
+    try:
+        return tiktoken.encoding_for_model(EXTRACTION_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def truncate_wikitext(wikitext: str) -> str:
+    """Cut very long articles to stay within the token budget."""
+    encoding = _model_encoding()
+    tokens = encoding.encode(wikitext, disallowed_special=())
+    if len(tokens) <= MAX_WIKITEXT_TOKENS:
+        return wikitext
+    # A token boundary can fall inside a multi-byte character; drop the
+    # partial bytes rather than emit U+FFFD
+    head = encoding.decode_bytes(tokens[:MAX_WIKITEXT_TOKENS]).decode("utf-8", errors="ignore")
+    return head + "\n\n[... article truncated ...]"
+
+
+def build_messages(country_name: str, wikitext: str) -> list[dict]:
+    """Chat messages for one country: static system prompt first, article last.
+
+    `wikitext` should already have been through trim_wikitext.
+    """
+    wikitext = truncate_wikitext(wikitext)
+
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": [
+            {"type": "text", "text": USER_PROMPT_PREFIX.format(country_name=country_name)},
+            {"type": "text", "text": wikitext},
+        ]},
+    ]
+
+
+def build_request_body(country_name: str, wikitext: str) -> dict:
+    """Chat completion parameters shared by the direct and batch paths."""
+    return {
+        "model": EXTRACTION_MODEL,
+        "max_tokens": 1024,
+        "messages": build_messages(country_name, wikitext),
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "plate_format",
+                "schema": PLATE_FORMAT_SCHEMA,
+                "strict": True,
+            },
+        },
+    }
+
+
+async def read_completion_stream(stream) -> tuple[Optional[str], object]:
+    """Collect a streamed chat completion into (reply text, usage).
+
+    The text is None if the model refused or ran out of tokens -- the only
+    ways a structured-outputs reply can fail to match the schema.  Usage is
+    only present when the request set stream_options.include_usage.
+    """
+    parts = []
+    usage = None
+    finish_reason = None
+    async for chunk in stream:
+        if chunk.usage is not None:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        if choice.delta.refusal:
+            finish_reason = "refusal"
+        if choice.delta.content:
+            parts.append(choice.delta.content)
+        if choice.finish_reason and finish_reason != "refusal":
+            finish_reason = choice.finish_reason
+    if finish_reason != "stop":
+        return None, usage
+    return "".join(parts), usage
+
+
+async def extract_with_openai(client: openai.AsyncOpenAI, country_name: str, wikitext: str,
+                              cache_dir: Optional[Path] = None,
+                              refresh: bool = False) -> Optional[dict]:
+    """Send wikitext to OpenAI and extract structured plate format data.
+
+    Replies are looked up in / stored to `cache_dir` unless it is None;
+    `refresh` skips the lookup but still stores the new reply.
+    """
+    key = llm_cache_key(country_name, wikitext)
+    response_text = None if refresh else llm_cache_get(cache_dir, key)
+    if response_text is None:
+        stream = await client.chat.completions.create(
+            **build_request_body(country_name, wikitext),
+            stream=True, stream_options={"include_usage": True})
+        response_text, usage = await read_completion_stream(stream)
+        if usage is not None:
+            details = usage.prompt_tokens_details
+            cached = details.cached_tokens if details else 0
+            print(f"  {country_name}: {cached}/{usage.prompt_tokens} prompt tokens "
+                  f"served from OpenAI's prompt cache")
+        if response_text is None:
+            return None
+        llm_cache_put(cache_dir, key, country_name, response_text)
+    return json_loads(response_text)
+
+
+async def _run_batch(client: openai.AsyncOpenAI,
+                     misses: dict[str, tuple[str, str]]) -> Optional[str]:
+    """Submit one batch job for `misses` and wait for it.
+
+    Returns the raw JSONL output, or None if the batch did not complete.
+    """
+    lines = [
+        json_dumps({
+            "custom_id": iso,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": build_request_body(country_name, wikitext),
+        })
+        for iso, (country_name, wikitext) in misses.items()
+    ]
+    batch_input = await client.files.create(
+        file=("plate_formats_batch.jsonl", b"\n".join(lines)),
+        purpose="batch",
     )
+    batch = await client.batches.create(
+        input_file_id=batch_input.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    print(f"Submitted batch {batch.id} with {len(misses)} requests")
+
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(BATCH_POLL_INTERVAL)
+        batch = await client.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        done = f"{counts.completed}/{counts.total}" if counts else "?"
+        print(f"  Batch {batch.status} ({done} done)")
+
+    if batch.status != "completed" or not batch.output_file_id:
+        print(f"  Batch ended with status '{batch.status}'")
+        return None
+
+    return (await client.files.content(batch.output_file_id)).text
+
 
-    response_text = response.choices[0].message.content.strip()
+async def extract_with_openai_batch(client: openai.AsyncOpenAI,
+                                    jobs: dict[str, tuple[str, str]],
+                                    cache_dir: Optional[Path] = None,
+                                    refresh: frozenset[str] = frozenset()) -> dict[str, dict]:
+    """Run every extraction as a single OpenAI Batch API job.
 
-    # Strip markdown code fences if present
-    if response_text.startswith("```"):
-        response_text = response_text.split("\n", 1)[1]
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
-        response_text = response_text.strip()
+    `jobs` maps ISO code -> (country_name, wikitext).  Cached replies are
+    used directly (except for ISO codes in `refresh`) and only the misses are
+    submitted.  Blocks until the batch finishes and returns ISO code -> parsed
+    result; countries whose request failed or whose reply could not be parsed
+    are reported and left out.  Cache hits are returned even if the batch
+    itself fails.
+    """
+    results = {}
+    keys = {}
+    misses = {}
+    for iso, (country_name, wikitext) in jobs.items():
+        keys[iso] = llm_cache_key(country_name, wikitext)
+        response_text = None if iso in refresh else llm_cache_get(cache_dir, keys[iso])
+        if response_text is None:
+            misses[iso] = (country_name, wikitext)
+            continue
+        try:
+            results[iso] = json_loads(response_text)
+        except json.JSONDecodeError as e:
+            print(f"[{iso}] unparsable cached reply: {e}")
+    if not misses:
+        return results
+
+    try:
+        output = await _run_batch(client, misses)
+    except openai.APIError as e:
+        print(f"OpenAI API error: {e}")
+        return results
+    if output is None:
+        return results
+
+    # One bad line must not cost the rest of an already paid-for batch
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        try:
+            item = json_loads(line)
+            iso = item["custom_id"]
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                print(f"[{iso}] request failed: {item.get('error') or response.get('status_code')}")
+                continue
+            choice = response["body"]["choices"][0]
+            if choice["finish_reason"] != "stop" or not choice["message"]["content"]:
+                print(f"[{iso}] no result from OpenAI ({choice['finish_reason']})")
+                continue
+            content = choice["message"]["content"]
+            llm_cache_put(cache_dir, keys[iso], jobs[iso][0], content)
+            results[iso] = json_loads(content)
+        except (json.JSONDecodeError, KeyError, IndexError, TypeError) as e:
+            print(f"  Skipping malformed batch output line ({e!r}): {line[:200]}")
+    return results
+
+
+def load_sidecar(sidecar_path: Path) -> dict[str, dict]:
+    """Replay the append-only results log; later lines win per ISO code.
+
+    A torn final line (from a crash mid-write) is ignored.
+    """
+    entries = {}
+    if not sidecar_path.exists():
+        return entries
+    for line in sidecar_path.read_bytes().splitlines():
+        if not line.strip():
+            continue
+        try:
+            entry = json_loads(line)
+        except json.JSONDecodeError:
+            continue
+        entries[entry["iso"]] = entry
+    return entries
+
+
+def record_result(metadata: dict, sidecar, iso: str, country_name: str,
+                  article_suffix: str, revid: Optional[int], result: dict) -> None:
+    """Annotate an extraction result, store it and append it to the sidecar log.
+
+    Each line is fsynced, so a crashed run loses at most the reply in flight;
+    the full output file is only rewritten once at the end of the run.
+    """
+    result["country_name"] = country_name
+    result["iso"] = iso
+    result["wikipedia_article"] = f"Vehicle_registration_plates_of_{article_suffix}"
+    result["wikipedia_revid"] = revid
+    result["extracted_at"] = datetime.now(timezone.utc).isoformat()
+    metadata["entries"][iso] = result
+    print(f"[{iso}] {country_name} -- format: {result['format_pattern'] or 'N/A'}")
+
+    sidecar.write(json_dumps(result) + b"\n")
+    sidecar.flush()
+    os.fsync(sidecar.fileno())
+
+
+async def process_country(client: openai.AsyncOpenAI, semaphore: asyncio.Semaphore,
+                          metadata: dict, sidecar, iso: str, country_name: str,
+                          article_suffix: str, revid: Optional[int], wikitext: str,
+                          cache_dir: Optional[Path], refresh: bool) -> bool:
+    """Extract and record one country's plate format; returns True on success.
 
-    return json.loads(response_text)
+    Rate-limit errors that outlast the SDK's own retries are retried here.
+    The server's retry-after is applied to openai_backoff, so every task
+    waits it out before its next request, not just this one.  Any other
+    failure only fails this country, so one dropped stream cannot cancel
+    the rest of the task group.
+    """
+    try:
+        async with semaphore:
+            for attempt in range(MAX_RETRIES):
+                await openai_backoff.wait()
+                try:
+                    result = await extract_with_openai(client, country_name, wikitext,
+                                                       cache_dir, refresh)
+                    break
+                except openai.RateLimitError as e:
+                    if e.code == "insufficient_quota" or attempt == MAX_RETRIES - 1:
+                        raise
+                    wait = _retry_delay(e.response, attempt)
+                    print(f"[{iso}] {country_name} -- OpenAI rate limit, retrying in {wait:.1f}s")
+                    openai_backoff.pause(wait)
+    except openai.APIError as e:
+        print(f"[{iso}] {country_name} -- OpenAI API error: {e}")
+        return False
+    except httpx.HTTPError as e:
+        # Connection dropped mid-stream; the SDK only wraps errors raised
+        # before the response starts
+        print(f"[{iso}] {country_name} -- network error: {e!r}")
+        return False
+    except json.JSONDecodeError as e:
+        print(f"[{iso}] {country_name} -- unparsable reply: {e}")
+        return False
+
+    if not result:
+        print(f"[{iso}] {country_name} -- no result from OpenAI")
+        return False
+
+    # No lock needed: nothing here awaits, so tasks cannot interleave
+    record_result(metadata, sidecar, iso, country_name, article_suffix, revid, result)
+    return True
 
 
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
 
-def main():
+def positive_int(value: str) -> int:
+    """argparse type for counts that must be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def print_country_codes() -> None:
+    """List every supported ISO code with its country name."""
+    print("Available codes:")
+    for code, name, _ in sorted(COUNTRIES):
+        print(f"  {code:4s}  {name}")
+
+
+async def main():
     parser = argparse.ArgumentParser(
         description="Collect license plate format info from Wikipedia via Claude")
     parser.add_argument("--dry-run", action="store_true",
@@ -179,6 +863,21 @@ def main():
                         help="Process only one country (ISO code, e.g. DE)")
     parser.add_argument("--output-dir", type=str, default="dataset",
                         help="Output directory (default: dataset)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Submit all extractions as one OpenAI Batch API job "
+                             "(half price, may take up to 24h)")
+    parser.add_argument("--concurrency", type=positive_int, default=EXTRACT_CONCURRENCY,
+                        help="Maximum OpenAI requests in flight "
+                             f"(default: {EXTRACT_CONCURRENCY})")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Neither read nor write the LLM response cache")
+    parser.add_argument("--no-wiki-cache", action="store_true",
+                        help="Always fetch wikitext, ignoring and not writing the "
+                             "24h wikitext cache")
+    parser.add_argument("--refresh", type=str, action="append", default=[],
+                        metavar="ISO",
+                        help="Re-extract this country even if already collected, "
+                             "bypassing the LLM cache (repeatable)")
     args = parser.parse_args()
 
     api_key = os.environ.get("OPENAI_API_KEY")
@@ -190,98 +889,172 @@ def main():
     output_dir = Path(args.output_dir)
     (output_dir / "metadata").mkdir(parents=True, exist_ok=True)
 
-    session = requests.Session()
-    session.headers.update({"User-Agent": USER_AGENT})
+    cache_dir = None if args.no_cache else output_dir / "metadata" / LLM_CACHE_DIR
+    wiki_cache_dir = None if args.no_wiki_cache else output_dir / "metadata" / WIKI_CACHE_DIR
+    refresh = frozenset(code.upper() for code in args.refresh)
+    unknown = sorted(refresh - _BY_ISO.keys())
+    if unknown:
+        print(f"Unknown country code(s) for --refresh: {', '.join(unknown)}")
+        print_country_codes()
+        return
 
     client = None
     if not args.dry_run:
-        client = openai.OpenAI(api_key=api_key)
+        client = openai.AsyncOpenAI(api_key=api_key)
 
     # Determine which countries to process
-    countries = dict(COUNTRIES)
+    countries = COUNTRIES
     if args.country:
         code = args.country.upper()
-        if code not in countries:
+        if code not in _BY_ISO:
             print(f"Unknown country code: {code}")
-            print("Available codes:")
-            for c, (name, _) in sorted(countries.items()):
-                print(f"  {c:4s}  {name}")
+            print_country_codes()
             return
-        countries = {code: countries[code]}
+        countries = (_BY_ISO[code],)
 
-    # Load existing results for incremental updates
+    # Load existing results for incremental updates, including any results
+    # an interrupted run left in the sidecar log
     output_path = output_dir / "metadata" / "plate_formats.json"
+    sidecar_path = output_dir / "metadata" / "plate_formats.ndjson"
     metadata = {
         "generated_at": datetime.now(timezone.utc).isoformat(),
         "source": "Wikipedia (per-country vehicle registration plate articles)",
-        "extraction_model": "gpt-4o-mini",
+        "extraction_model": EXTRACTION_MODEL,
         "entries": {},
     }
-    if output_path.exists() and not args.country:
-        with open(output_path) as f:
-            existing = json.load(f)
-            metadata["entries"] = existing.get("entries", {})
+    if output_path.exists():
+        existing = json_loads(output_path.read_bytes())
+        metadata["entries"] = existing.get("entries", {})
+    metadata["entries"].update(load_sidecar(sidecar_path))
 
     success = 0
     failed = 0
     skipped = 0
 
-    for iso, (country_name, article_suffix) in countries.items():
-        # Skip if already collected (unless single-country mode)
-        if iso in metadata["entries"] and not args.country:
-            print(f"[{iso}] {country_name} -- already collected, skipping")
-            skipped += 1
-            continue
+    # 1. Fetch wikitext.  Already-collected countries are only re-processed
+    #    when their article has a new revision (always in single-country mode
+    #    or with --refresh).  Entries collected before revision IDs were
+    #    recorded only get the current revid backfilled, since many of them
+    #    were curated by hand.  Articles fetched within WIKI_CACHE_TTL are
+    #    read from disk, revision ID included.
+    cached = {}
+    for iso, _, article_suffix in countries:
+        hit = wiki_cache_get(wiki_cache_dir, article_suffix)
+        if hit is not None:
+            cached[iso] = hit
 
-        print(f"\n[{iso}] {country_name}")
+    # One client for the whole run: HTTP/2 multiplexes every Wikipedia request
+    # over a single kept-alive TLS connection
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=MAX_RETRIES,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+    )
+    async with httpx.AsyncClient(
+        transport=transport,
+        headers={"User-Agent": USER_AGENT},
+        timeout=30.0,
+    ) as session:
+        if args.country:
+            to_fetch = {code: _BY_ISO[code][2]}
+            if code in cached:
+                fetched = {code: cached[code]}
+            else:
+                wikitext, revid = await fetch_article_wikitext(session, to_fetch[code])
+                fetched = {code: (wikitext, revid)} if wikitext is not None else {}
+        else:
+            known_revids = {
+                iso: metadata["entries"][iso].get("wikipedia_revid")
+                for iso, _, _ in countries
+                if iso in metadata["entries"] and iso not in refresh
+            }
+            current_revids = {iso: cached[iso][1] for iso in known_revids if iso in cached}
+            current_revids.update(await fetch_all_revids(session, {
+                iso: _BY_ISO[iso][2] for iso in known_revids if iso not in cached
+            }))
+            to_fetch = {}
+            for iso, country_name, article_suffix in countries:
+                revid = current_revids.get(iso)
+                if revid is not None and iso in known_revids and known_revids[iso] is None:
+                    metadata["entries"][iso]["wikipedia_revid"] = revid
+                    print(f"[{iso}] {country_name} -- recorded revid {revid}, skipping")
+                    skipped += 1
+                    continue
+                if revid is not None and revid == known_revids.get(iso):
+                    print(f"[{iso}] {country_name} -- unchanged (revid {revid}), skipping")
+                    skipped += 1
+                    continue
+                to_fetch[iso] = article_suffix
+            fetched = {iso: cached[iso] for iso in to_fetch if iso in cached}
+            missing = {iso: suffix for iso, suffix in to_fetch.items() if iso not in cached}
+            print(f"Fetching {len(missing)} articles ({len(fetched)} cached)...")
+            fetched.update(await fetch_all_wikitexts(session, missing))
 
-        # 1. Fetch wikitext
-        print(f"  Fetching: Vehicle_registration_plates_of_{article_suffix}")
-        wikitext = fetch_article_wikitext(session, article_suffix)
+    for iso, (wikitext, revid) in fetched.items():
+        if iso not in cached:
+            wiki_cache_put(wiki_cache_dir, _BY_ISO[iso][2], wikitext, revid)
 
-        if wikitext is None:
-            print(f"  Article not found!")
-            failed += 1
-            continue
+    # 2. Extract with OpenAI, at most --concurrency requests in flight
+    sidecar = open(os.devnull if args.dry_run else sidecar_path, "ab")
+    with sidecar:
+        jobs = {}
+        batch_jobs = {}
+        revids = {}
 
-        print(f"  Wikitext: {len(wikitext)} chars")
+        for iso, article_suffix in to_fetch.items():
+            country_name = _BY_ISO[iso][1]
+            if iso not in fetched:
+                print(f"[{iso}] {country_name} -- article not found!")
+                failed += 1
+                continue
 
-        if args.dry_run:
-            success += 1
-            continue
+            wikitext, revid = fetched[iso]
+            revids[iso] = revid
+            trimmed = trim_wikitext(wikitext)
+            print(f"[{iso}] {country_name} -- fetched {len(wikitext)} chars, "
+                  f"{len(trimmed)} after trimming "
+                  f"(Vehicle_registration_plates_of_{article_suffix})")
 
-        # 2. Extract with OpenAI
-        print(f"  Extracting format data with OpenAI...")
-        try:
-            result = extract_with_openai(client, country_name, wikitext)
-            if result:
-                result["country_name"] = country_name
-                result["iso"] = iso
-                result["wikipedia_article"] = f"Vehicle_registration_plates_of_{article_suffix}"
-                result["extracted_at"] = datetime.now(timezone.utc).isoformat()
-                metadata["entries"][iso] = result
-                print(f"  Format: {result.get('format_pattern', 'N/A')}")
+            if args.dry_run:
                 success += 1
+                continue
 
-                # Write incrementally
-                metadata["generated_at"] = datetime.now(timezone.utc).isoformat()
-                with open(output_path, "w") as f:
-                    json.dump(metadata, f, indent=2, ensure_ascii=False)
+            if args.batch:
+                batch_jobs[iso] = (country_name, trimmed)
             else:
-                print(f"  No result from OpenAI")
-                failed += 1
-        except json.JSONDecodeError as e:
-            print(f"  Failed to parse OpenAI response: {e}")
-            failed += 1
-        except openai.APIError as e:
-            print(f"  OpenAI API error: {e}")
-            failed += 1
+                jobs[iso] = (country_name, article_suffix, trimmed)
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+        async with asyncio.TaskGroup() as tg:
+            tasks = [
+                tg.create_task(process_country(
+                    client, semaphore, metadata, sidecar, iso, country_name,
+                    article_suffix, revids[iso], wikitext, cache_dir, iso in refresh))
+                for iso, (country_name, article_suffix, wikitext) in jobs.items()
+            ]
+        succeeded = sum(task.result() for task in tasks)
+        success += succeeded
+        failed += len(tasks) - succeeded
+
+        if batch_jobs:
+            results = await extract_with_openai_batch(client, batch_jobs, cache_dir, refresh)
+            for iso, result in results.items():
+                _, country_name, article_suffix = _BY_ISO[iso]
+                record_result(metadata, sidecar, iso, country_name, article_suffix,
+                              revids[iso], result)
+            success += len(results)
+            failed += len(batch_jobs) - len(results)
 
-    # Final write
+    # Final write: consolidate everything into the pretty JSON once, via a
+    # temp file so a crash mid-write leaves the old file intact; only then is
+    # the sidecar log redundant
     if not args.dry_run:
         metadata["generated_at"] = datetime.now(timezone.utc).isoformat()
-        with open(output_path, "w") as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        tmp_path = output_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(json_dumps(metadata, indent=True))
+        os.replace(tmp_path, output_path)
+        sidecar_path.unlink(missing_ok=True)
 
     print(f"\nDone: {success} succeeded, {failed} failed, {skipped} skipped")
     if not args.dry_run:
@@ -289,4 +1062,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())